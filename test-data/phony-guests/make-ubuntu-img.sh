@@ -21,8 +21,15 @@
 export LANG=C
 set -e
 
+# Stage the guest files in a local tree and roll them into a single
+# tarball, so that one tar-in call replaces a series of upload, write
+# and touch calls (each one is a round trip to the appliance).
+rm -rf ubuntu.d ubuntu.tar
+mkdir -p ubuntu.d/bin ubuntu.d/boot/grub ubuntu.d/etc ubuntu.d/home \
+    ubuntu.d/usr ubuntu.d/var/lib/dpkg ubuntu.d/var/lib/urandom
+
 # fstab file.
-cat > ubuntu.fstab <<EOF
+cat > ubuntu.d/etc/fstab <<EOF
 LABEL=BOOT /boot ext2 default 0 0
 /dev/sda2 / ext2 default 1 2
 
@@ -31,13 +38,21 @@ LABEL=BOOT /boot ext2 default 0 0
 EOF
 
 # lsb-release file.
-cat > ubuntu.release <<'EOF'
+cat > ubuntu.d/etc/lsb-release <<'EOF'
 DISTRIB_ID=Ubuntu
 DISTRIB_RELEASE=10.10
 DISTRIB_CODENAME=maverick
 DISTRIB_DESCRIPTION="Ubuntu 10.10 (Phony Pharaoh)"
 EOF
 
+printf '5.0.1' > ubuntu.d/etc/debian_version
+printf 'ubuntu.invalid' > ubuntu.d/etc/hostname
+cp $SRCDIR/debian-packages ubuntu.d/var/lib/dpkg/status
+cp $SRCDIR/../binaries/bin-x86_64-dynamic ubuntu.d/bin/ls
+chmod 0755 ubuntu.d/bin/ls
+touch ubuntu.d/boot/grub/grub.conf
+tar -C ubuntu.d -cf ubuntu.tar .
+
 # Create a disk image.
 guestfish <<EOF
 sparse ubuntu.img-t 512M
@@ -57,29 +72,14 @@ set-e2uuid /dev/sda1 01234567-0123-0123-0123-012345678901
 mkfs ext2 /dev/sda2 blocksize:4096
 set-e2uuid /dev/sda2 01234567-0123-0123-0123-012345678902
 
-# Enough to fool inspection API.
+# Enough to fool inspection API.  The directory tree comes from the
+# tarball, only the /boot mountpoint has to exist beforehand.
 mount /dev/sda2 /
 mkdir /boot
 mount /dev/sda1 /boot
-mkdir /bin
-mkdir /etc
-mkdir /home
-mkdir /usr
-mkdir-p /var/lib/dpkg
-mkdir /var/lib/urandom
-
-upload ubuntu.fstab /etc/fstab
-write /etc/debian_version "5.0.1"
-upload ubuntu.release /etc/lsb-release
-write /etc/hostname "ubuntu.invalid"
-
-upload $SRCDIR/debian-packages /var/lib/dpkg/status
-
-upload $SRCDIR/../binaries/bin-x86_64-dynamic /bin/ls
 
-mkdir /boot/grub
-touch /boot/grub/grub.conf
+tar-in ubuntu.tar /
 EOF
 
-rm ubuntu.fstab ubuntu.release
+rm -r ubuntu.d ubuntu.tar
 mv ubuntu.img-t ubuntu.img
@@ -21,25 +21,46 @@
 export LANG=C
 set -e
 
+# Use a single appliance both for the NTFS support probe and for
+# building the image.  Probing used to boot a second, throwaway
+# appliance with a null drive, doubling the (multi-second) launch
+# cost of this script.
+eval `guestfish --listen`
+
+guestfish --remote -- sparse windows.img-t 512M
+guestfish --remote -- run
+
 # If the currently compiled libguestfs doesn't support
 # ntfs-3g/ntfsprogs then we cannot create a Windows phony image.
 # Nothing actually uses windows.img in the standard build so we can
 # just 'touch' it and emit a warning.
-if ! guestfish -a /dev/null run : available "ntfs3g ntfsprogs"; then
+if ! guestfish --remote -- available "ntfs3g ntfsprogs"; then
+  guestfish --remote -- exit
   echo "***"
   echo "Warning: cannot create windows.img because there is no NTFS"
   echo "support in this build of libguestfs.  Just touching the output"
   echo "file instead."
   echo "***"
+  rm windows.img-t
   touch windows.img
   exit 0
 fi
 
-# Create a disk image.
-guestfish <<EOF
-sparse windows.img-t 512M
-run
+# Stage the guest files in a local tree and roll them into a single
+# tarball, so that one tar-in call replaces a series of upload, mkdir
+# and touch calls (each one is a round trip to the appliance).
+rm -rf windows.d windows.tar
+mkdir -p windows.d/Windows/System32/Config \
+    windows.d/Windows/System32/Drivers \
+    "windows.d/Program Files"
+cp $SRCDIR/windows-software windows.d/Windows/System32/Config/SOFTWARE
+cp $SRCDIR/windows-system windows.d/Windows/System32/Config/SYSTEM
+cp $SRCDIR/../binaries/bin-win32.exe windows.d/Windows/System32/cmd.exe
+touch windows.d/autoexec.bat
+tar -C windows.d -cf windows.tar .
 
+# Build the image in the already-running appliance.
+guestfish --remote <<EOF
 # Format the disk.
 part-init /dev/sda mbr
 part-add /dev/sda p 64     524287
@@ -56,17 +77,11 @@ mkfs ntfs /dev/sda2
 
 # Enough to fool inspection API.
 mount /dev/sda2 /
-mkdir-p /Windows/System32/Config
-mkdir-p /Windows/System32/Drivers
-
-upload $SRCDIR/windows-software /Windows/System32/Config/SOFTWARE
-upload $SRCDIR/windows-system /Windows/System32/Config/SYSTEM
-
-upload $SRCDIR/../binaries/bin-win32.exe /Windows/System32/cmd.exe
-
-mkdir "/Program Files"
-touch /autoexec.bat
+tar-in windows.tar /
 
 EOF
 
+guestfish --remote -- exit
+
+rm -r windows.d windows.tar
 mv windows.img-t windows.img
@@ -61,13 +61,19 @@ $g->fill_dir ("/dir", $nr_files);
 # Listing the directory should be OK.
 my @filenames = $g->ls ("/dir");
 
-# Check the names (they should be sorted).
+# Check the names (they should be sorted).  Use Perl's magic string
+# increment ("00000000" -> "00000001") for the expected name, which
+# keeps the zero padding and avoids a million sprintf calls.
 die "incorrect number of filenames returned by \$g->ls"
     unless @filenames == $nr_files;
-for (my $i = 0; $i < $nr_files; ++$i) {
-    if ($filenames[$i] ne sprintf ("%08d", $i)) {
-        die "unexpected filename at index $i: $filenames[$i]";
+my $i = 0;
+my $expected = "00000000";
+foreach my $filename (@filenames) {
+    if ($filename ne $expected) {
+        die "unexpected filename at index $i: $filename";
     }
+    $expected++;
+    ++$i;
 }
 
 # Check that lstatlist, lxattrlist and readlinklist return the
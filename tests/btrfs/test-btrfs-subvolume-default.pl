@@ -52,11 +52,9 @@ my @vols = $g->btrfs_subvolume_list ("/");
 # and the top level ID (which should be the same for both subvolumes).
 die ("expected 2 subvolumes, but got ", 0+@vols, " instead") unless @vols == 2;
 
-my %ids;
+my $test1_id;
 my $top_level_id;
 foreach (@vols) {
-    my $path = $_->{btrfssubvolume_path};
-    my $id = $_->{btrfssubvolume_id};
     my $top = $_->{btrfssubvolume_top_level_id};
 
     if (!defined $top_level_id) {
@@ -65,12 +63,12 @@ foreach (@vols) {
         die "top_level_id fields are not all the same";
     }
 
-    $ids{$path} = $id;
+    if ($_->{btrfssubvolume_path} eq "test1") {
+        $test1_id = $_->{btrfssubvolume_id};
+    }
 }
 
-die "no subvolume path 'test1' found" unless exists $ids{test1};
-
-my $test1_id = $ids{test1};
+die "no subvolume path 'test1' found" unless defined $test1_id;
 
 $g->btrfs_subvolume_set_default ($test1_id, "/");
 $g->umount ("/");
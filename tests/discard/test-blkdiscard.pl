@@ -36,9 +36,10 @@ if ($ENV{SKIP_TEST_BLKDISCARD_PL}) {
 my $g = Sys::Guestfs->new ();
 
 # Discard is only supported when using qemu.
-if ($g->get_backend () ne "libvirt" &&
-    $g->get_backend () !~ /^libvirt:/ &&
-    $g->get_backend () ne "direct") {
+my $backend = $g->get_backend ();
+if ($backend ne "libvirt" &&
+    $backend !~ /^libvirt:/ &&
+    $backend ne "direct") {
     print "$0: skipped test because discard is only supported when using qemu\n";
     exit 77;
 }
@@ -93,20 +94,12 @@ unless ($g->feature_available (["blkdiscard"])) {
 my $orig_size = (stat ($disk))[12];
 print "original size:\t$orig_size (blocks)\n";
 
-# Fill the block device with non-zero data.
-
-my $i = $size;
-my $offset = 0;
-while ($i > 0) {
-    my $data;
-    if ($i >= 1024*1024) {
-        $data = "*" x (1024*1024)
-    } else {
-        $data = "*" x $i
-    }
+# Fill the block device with non-zero data.  $size is a whole number
+# of MiB, so we can write the same preallocated 1 MiB buffer at each
+# offset instead of building a fresh string per iteration.
+my $data = "*" x (1024*1024);
+for (my $offset = 0; $offset < $size; $offset += 1024*1024) {
     $g->pwrite_device ("/dev/sda", $data, $offset);
-    $offset += length $data;
-    $i -= length $data;
 }
 $g->sync ();
 
@@ -36,9 +36,10 @@ if ($ENV{SKIP_TEST_FSTRIM_PL}) {
 my $g = Sys::Guestfs->new ();
 
 # Discard is only supported when using qemu.
-if ($g->get_backend () ne "libvirt" &&
-    $g->get_backend () !~ /^libvirt:/ &&
-    $g->get_backend () ne "direct") {
+my $backend = $g->get_backend ();
+if ($backend ne "libvirt" &&
+    $backend !~ /^libvirt:/ &&
+    $backend ne "direct") {
     print "$0: skipped test because discard is only supported when using qemu\n";
     exit 77;
 }
@@ -20,6 +20,21 @@ use warnings;
 
 use Sys::Guestfs;
 
+# Compiled once, used for every sgdisk -p output check.
+my $last_usable_re = qr/last usable sector is (\d+)/;
+
+# Check that the last usable sector is within 34 sectors of the end
+# of a disk of $size_mb megabytes.
+sub check_last_usable_sector {
+	my ($g, $device, $size_mb) = @_;
+
+	my $output = $g->debug ("sh", ["sgdisk", "-p", $device]);
+	die if $output eq "";
+	die unless $output =~ $last_usable_re;
+	my $end_sectors = $size_mb * 1024 * 2 - $1;
+	die unless $end_sectors <= 34;
+}
+
 sub tests {
 	my $g = Sys::Guestfs->new ();
 
@@ -33,50 +48,34 @@ sub tests {
 	$g->part_disk ("/dev/sda", "gpt");
 	$g->part_disk ("/dev/sdb", "mbr");
 
-	$g->close ();
+	# shutdown releases the disks (qemu-img needs exclusive access)
+	# and returns the handle to the config state for relaunch.
+	$g->shutdown ();
 
 	die if system ("qemu-img resize disk_gpt.img 100M &>/dev/null");
 
-	$g = Sys::Guestfs->new ();
-
 	foreach ("gpt", "mbr") {
 		$g->add_drive ("disk_$_.img", format => "qcow2");
 	}
 
 	$g->launch ();
 	die if $g->part_expand_gpt ("/dev/sda");
-
-	my $output = $g->debug ("sh", ["sgdisk", "-p", "/dev/sda"]);
-	die if $output eq "";
-	$output =~ s/\n/ /g;
-	$output =~ s/.*last usable sector is (\d+).*/$1/g;
-
-	my $end_sectors = 100 * 1024 * 2 - $output;
-	die unless $end_sectors <= 34;
+	check_last_usable_sector ($g, "/dev/sda", 100);
 
 	# Negative test.
 	eval { $g->part_expand_gpt ("/dev/sdb") };
 	die unless $@;
 
-	$g->close ();
+	$g->shutdown ();
 
 	# Disk shrink test
 	die if system ("qemu-img resize --shrink disk_gpt.img 50M &>/dev/null");
 
-	$g = Sys::Guestfs->new ();
-
 	$g->add_drive ("disk_gpt.img", format => "qcow2");
 	$g->launch ();
 
 	die if $g->part_expand_gpt ("/dev/sda");
-
-	my $output = $g->debug ("sh", ["sgdisk", "-p", "/dev/sda"]);
-	die if $output eq "";
-	$output =~ s/\n/ /g;
-	$output =~ s/.*last usable sector is (\d+).*/$1/g;
-
-	my $end_sectors = 50 * 1024 * 2 - $output;
-	die unless $end_sectors <= 34;
+	check_last_usable_sector ($g, "/dev/sda", 50);
 }
 
 eval { tests() };
@@ -19,12 +19,16 @@
 import sys
 import os
 import re
-import shutil
-from time import sleep
-from random import randint
+import socket
+import threading
+
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
 
 progname = os.path.basename(sys.argv[0])
 guestsdir = "../test-data/phony-guests"
+guestsdir_abs = os.path.abspath(guestsdir)
 listen_addr = "localhost"
 #listen_addr = "127.0.0.1"
 #listen_addr = ""
@@ -39,153 +43,162 @@ if os.getenv('SKIP_TEST_HTTP_PY'):
 # Proxy settings can break this test.
 del os.environ['http_proxy']
 
-# Remove the stamp file.
-stampfile = "%s/stamp-test-http" % os.getcwd()
-
-def unlink_stampfile():
-    try:
-        os.unlink(stampfile)
-    except:
-        pass
-unlink_stampfile()
-
-# Choose a random port number.
-# XXX Should check it is not in use.
-port = randint(60000, 65000)
-
-pid = os.fork()
-if pid > 0:
-    # Parent (client).
-    import guestfs
-
-    # Make sure that the child (HTTP server) is killed on exit even if
-    # we exit abnormally.
-    def cleanup():
-        unlink_stampfile()
-        if pid > 0:
-            os.kill(pid, 15)
-    sys.exitfunc = cleanup
-
-    # Wait for the child to touch the stamp file to indicate it has
-    # started listening for requests.
-    for i in range(1, 10):
-        if os.access(stampfile, os.F_OK):
-            break
-        sleep(1)
-        if i == 3:
-            print("%s: waiting for the web server to start up ..." % progname)
-    if not os.access(stampfile, os.F_OK):
-        print >>sys.stderr, \
-            ("%s: error: web server process did not start up" % progname)
-        exit(1)
-
-    # Create libguestfs handle and connect to the web server.
-    g = guestfs.GuestFS(python_return_dict=True)
-    server = "%s:%d" % (connect_addr, port)
-    g.add_drive_opts("/fedora.img", readonly=True, format="raw",
-                     protocol="http", server=[server])
-    g.launch()
-
-    # Inspection is quite a thorough test.
-    roots = g.inspect_os()
-    if len(roots) == 0:
-        print >>sys.stderr, \
-            ("%s: error: inspection failed to find any OSes in guest image" %
-             progname)
-        exit(1)
-    if len(roots) > 1:
-        print >>sys.stderr, \
-            ("%s: error: inspection found a multi-boot OS which is not "
-             "expected" % progname)
-        exit(1)
-
-    type_ = g.inspect_get_type(roots[0])
-    distro = g.inspect_get_distro(roots[0])
-    if type_ != "linux" or distro != "fedora":
-        print >>sys.stderr, \
-            ("%s: error: inspection found wrong OS type (%s, %s)" %
-             (progname, type_, distro))
-        exit(1)
-
-    g.close()
-
-else:
-    # Child (HTTP server).
-    from BaseHTTPServer import HTTPServer
-    from SimpleHTTPServer import SimpleHTTPRequestHandler
-    from SocketServer import ThreadingMixIn
-
-    os.chdir(guestsdir)
-
-    class ThreadingServer(ThreadingMixIn, HTTPServer):
-        pass
-
-    # This is an extended version of SimpleHTTPRequestHandler that can
-    # handle byte ranges.  See also:
-    # https://naclports.googlecode.com/svn/trunk/src/httpd.py
-    class ByteRangeRequestHandler(SimpleHTTPRequestHandler):
-        def do_GET(self):
-            if 'Range' in self.headers:
-                m = re.match('\s*bytes\s*=\s*(\d+)\s*-\s*(\d+)\s*',
-                             self.headers['Range'])
-            if m:
-                start = int(m.group(1))
-                end = int(m.group(2))
-                length = end - start + 1
-                f = self.send_head_partial(start, length)
-                if f:
-                    f.seek(start, os.SEEK_CUR)
-                    shutil.copyfileobj(f, self.wfile, length)
-                    f.close()
-                return
-
-            return SimpleHTTPRequestHandler.do_GET(self)
-
-        def send_head_partial(self, offset, length):
-            path = self.translate_path(self.path)
-            f = None
-            if os.path.isdir(path):
-                if not self.path.endswith('/'):
-                    # redirect browser - doing basically what apache does
-                    self.send_response(301)
-                    self.send_header("Location", self.path + "/")
-                    self.end_headers()
-                    return None
-                for index in "index.html", "index.htm":
-                    index = os.path.join(path, index)
-                    if os.path.exists(index):
-                        path = index
-                        break
-                    else:
-                        return self.list_directory(path)
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    pass
+
+# Compiled once; matched against the Range header of every request.
+range_re = re.compile(r'\s*bytes\s*=\s*(\d+)\s*-\s*(\d+)\s*')
+
+# Cache of path -> (content type, mtime).  Range requests hit the
+# same file over and over, so the mimetypes lookup and the stat only
+# need to happen on the first request.
+file_meta_cache = {}
+
+# This is an extended version of SimpleHTTPRequestHandler that can
+# handle byte ranges.  See also:
+# https://naclports.googlecode.com/svn/trunk/src/httpd.py
+class ByteRangeRequestHandler(SimpleHTTPRequestHandler):
+    # Buffer the response stream.  The SocketServer default is
+    # unbuffered, which turns every status line, header and body
+    # chunk into its own send syscall.
+    wbufsize = 64 * 1024
+
+    def setup(self):
+        # libguestfs makes many back-to-back small range requests, so
+        # disable Nagle's algorithm and enlarge the send buffer.
+        self.request.setsockopt(socket.IPPROTO_TCP,
+                                socket.TCP_NODELAY, 1)
+        self.request.setsockopt(socket.SOL_SOCKET,
+                                socket.SO_SNDBUF, 1 << 20)
+        SimpleHTTPRequestHandler.setup(self)
+
+    def translate_path(self, path):
+        # The test only ever fetches the guest image, so skip the
+        # base class's normpath + per-component walk (several stat
+        # calls per request) for that case.
+        if path == "/fedora.img":
+            return os.path.join(guestsdir_abs, "fedora.img")
+        return SimpleHTTPRequestHandler.translate_path(self, path)
+
+    def do_GET(self):
+        m = None
+        if 'Range' in self.headers:
+            m = range_re.match(self.headers['Range'])
+        if m:
+            start = int(m.group(1))
+            end = int(m.group(2))
+            length = end - start + 1
+            f = self.send_head_partial(start, length)
+            if f:
+                self.send_range(f, start, length)
+                f.close()
+            return
+
+        return SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_range(self, f, start, length):
+        # Send the body through the kernel's zero-copy path where
+        # available (page cache straight to the socket), falling
+        # back to a userspace copy.
+        if hasattr(os, 'sendfile'):
+            self.wfile.flush()
+            out_fd = self.connection.fileno()
+            offset = start
+            remaining = length
+            while remaining > 0:
+                sent = os.sendfile(out_fd, f.fileno(), offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+        else:
+            f.seek(start, os.SEEK_CUR)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(65536, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+            self.wfile.flush()
+
+    def send_head_partial(self, offset, length):
+        # Range requests are only ever made against plain files, so
+        # there is no directory-index handling here (non-range
+        # requests fall through to SimpleHTTPRequestHandler).
+        path = self.translate_path(self.path)
+        f = None
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+        try:
+            ctype, mtime = file_meta_cache[path]
+        except KeyError:
             ctype = self.guess_type(path)
-            try:
-                f = open(path, 'rb')
-            except IOError:
-                self.send_error(404, "File not found")
-                return None
-            self.send_response(206, 'Partial content')
-            self.send_header("Content-Range", str(offset) + '-' +
-                             str(length+offset-1))
-            self.send_header("Content-Length", str(length))
-            self.send_header("Content-type", ctype)
-            fs = os.fstat(f.fileno())
-            self.send_header("Last-Modified",
-                             self.date_time_string(fs.st_mtime))
-            self.end_headers()
-            return f
-
-    server_address = (listen_addr, port)
-    httpd = ThreadingServer(server_address, ByteRangeRequestHandler)
-
-    sa = httpd.socket.getsockname()
-    print("%s: serving %s on %s port %d ..." % (progname,
-                                                os.getcwd(), sa[0], sa[1]))
-
-    # Touch the stamp file, which starts the client.
-    open(stampfile, 'a')
-
-    # Start serving until killed.
-    httpd.serve_forever()
-
-    os._exit(0)
+            mtime = os.fstat(f.fileno()).st_mtime
+            file_meta_cache[path] = (ctype, mtime)
+        self.send_response(206, 'Partial content')
+        self.send_header("Content-Range", str(offset) + '-' +
+                         str(length+offset-1))
+        self.send_header("Content-Length", str(length))
+        self.send_header("Content-type", ctype)
+        self.send_header("Last-Modified",
+                         self.date_time_string(mtime))
+        self.end_headers()
+        return f
+
+os.chdir(guestsdir)
+
+# Bind port 0 so the kernel allocates a free port, avoiding
+# collisions under parallel test runs.
+server_address = (listen_addr, 0)
+httpd = ThreadingServer(server_address, ByteRangeRequestHandler)
+
+sa = httpd.socket.getsockname()
+port = sa[1]
+print("%s: serving %s on %s port %d ..." % (progname,
+                                            os.getcwd(), sa[0], sa[1]))
+
+# Serve requests in a background thread.  The socket is already bound
+# and listening at this point, so there is no startup race: any
+# connection made before serve_forever runs simply queues on the
+# listen backlog.
+server_thread = threading.Thread(target=httpd.serve_forever)
+server_thread.daemon = True
+server_thread.start()
+
+import guestfs
+
+# Create libguestfs handle and connect to the web server.
+g = guestfs.GuestFS(python_return_dict=True)
+server = "%s:%d" % (connect_addr, port)
+g.add_drive_opts("/fedora.img", readonly=True, format="raw",
+                 protocol="http", server=[server])
+g.launch()
+
+# Inspection is quite a thorough test.
+roots = g.inspect_os()
+if len(roots) == 0:
+    print >>sys.stderr, \
+        ("%s: error: inspection failed to find any OSes in guest image" %
+         progname)
+    exit(1)
+if len(roots) > 1:
+    print >>sys.stderr, \
+        ("%s: error: inspection found a multi-boot OS which is not "
+         "expected" % progname)
+    exit(1)
+
+type_ = g.inspect_get_type(roots[0])
+distro = g.inspect_get_distro(roots[0])
+if type_ != "linux" or distro != "fedora":
+    print >>sys.stderr, \
+        ("%s: error: inspection found wrong OS type (%s, %s)" %
+         (progname, type_, distro))
+    exit(1)
+
+g.close()
+
+httpd.shutdown()
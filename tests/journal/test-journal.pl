@@ -45,19 +45,22 @@ $g->mount_ro ("/dev/VG/Root", "/");
 $g->journal_open ("/var/log/journal");
 
 eval {
-    # Count the number of journal entries by iterating over them.
-    # Save the first few.
+    # Save the first few journal entries.
     my $count = 0;
     my @entries = ();
-    while ($g->journal_next ()) {
+    while ($count < 5 && $g->journal_next ()) {
         $count++;
         my @fields = $g->journal_get ();
         # Turn the fields into a hash of field name -> data.
         my %fields = ();
         $fields{$_->{attrname}} = $_->{attrval} foreach @fields;
-        push @entries, \%fields if $count <= 5;
+        push @entries, \%fields;
     }
 
+    # Count the remaining entries with a single journal_skip call
+    # instead of one journal_next round-trip per entry.
+    $count += $g->journal_skip (1_000_000);
+
     die "incorrect # journal entries (got $count, expecting 2459)"
         unless $count == 2459;
 
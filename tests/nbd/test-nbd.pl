@@ -18,7 +18,9 @@
 use strict;
 use warnings;
 
+use IO::Socket::INET;
 use POSIX qw(getcwd);
+use Time::HiRes qw(usleep);
 
 use Sys::Guestfs;
 
@@ -27,28 +29,45 @@ END { kill 15, $pid if $pid > 0 };
 
 exit 77 if $ENV{SKIP_TEST_NBD_PL};
 
-if (Sys::Guestfs->new()->get_backend() eq "uml") {
+# One handle is shared by all the test cases below: shutdown returns
+# it to the config state (dropping the drive) ready for relaunch.
+my $g = Sys::Guestfs->new ();
+
+if ($g->get_backend () eq "uml") {
     print "$0: test skipped because UML backend does not support NBD\n";
     exit 77
 }
 
-# Check we have qemu-nbd.
-if (system ("qemu-nbd --help >/dev/null 2>&1") != 0) {
+# Check we have qemu-nbd, capturing the help output so it only has to
+# run once (the --format option is probed from it below).
+my $qemu_nbd_help = `qemu-nbd --help 2>/dev/null`;
+if ($? != 0) {
     print "$0: test skipped because qemu-nbd program not found\n";
     exit 77
 }
 
-# Make a local copy of the disk so we can open it for writes.
 my $disk = "../test-data/phony-guests/fedora.img";
 if (! -r $disk || -z $disk) {
     print "$0: test skipped because $disk is not found\n";
     exit 77
 }
 
-system ("cp $disk fedora-nbd.img") == 0 || die;
-$disk = "fedora-nbd.img";
+# The read-only test can serve the original image directly.  Only the
+# read-write tests need a local copy which they are allowed to modify,
+# so make it lazily (and only once).
+my $local_disk;
+sub local_copy {
+    unless (defined $local_disk) {
+        $local_disk = "fedora-nbd.img";
+        # --reflink=auto makes this O(1) on filesystems which support
+        # copy-on-write clones (btrfs, XFS), falling back to a normal
+        # copy elsewhere.
+        system ("cp", "--reflink=auto", $disk, $local_disk) == 0 || die;
+    }
+    $local_disk;
+}
 
-my $has_format_opt = system ("qemu-nbd --help | grep -q -- --format") == 0;
+my $has_format_opt = $qemu_nbd_help =~ /--format/;
 
 sub run_test {
     my $readonly = shift;
@@ -57,13 +76,24 @@ sub run_test {
     my $cwd = getcwd ();
     my $server;
     my $pidfile = "$cwd/nbd.pid";
-    my @qemu_nbd = ("qemu-nbd", $disk, "-t", "--pid-file", $pidfile);
+    my $test_disk = $readonly ? $disk : local_copy ();
+    my @qemu_nbd = ("qemu-nbd", $test_disk, "-t", "--pid-file", $pidfile);
+    if ($readonly) {
+        push @qemu_nbd, "-r";
+    }
     if ($has_format_opt) {
         push @qemu_nbd, "--format", "raw";
     }
     if ($tcp) {
-        # Choose a random port number.  XXX Should check it is not in use.
-        my $port = int (60000 + rand (5000));
+        # Ask the kernel for a free port rather than picking one at
+        # random and hoping it is not in use.
+        my $probe = IO::Socket::INET->new (LocalAddr => "127.0.0.1",
+                                           LocalPort => 0,
+                                           Proto => "tcp",
+                                           ReuseAddr => 1)
+            or die "could not allocate a free port: $!";
+        my $port = $probe->sockport ();
+        $probe->close ();
         push @qemu_nbd, "-p", $port;
         $server = "localhost:$port";
     }
@@ -83,10 +113,12 @@ sub run_test {
         die "qemu-nbd: $!";
     }
 
-    # Wait for the pid file to appear.
-    for (my $i = 0; $i < 60; ++$i) {
+    # Wait for the pid file to appear.  qemu-nbd normally writes it
+    # within a few tens of milliseconds, so poll frequently rather
+    # than sleeping whole seconds (timeout after 60 seconds).
+    for (my $i = 0; $i < 1200; ++$i) {
         last if -f $pidfile;
-        sleep 1
+        usleep (50_000);
     }
     die "qemu-nbd did not start up\n" if ! -f $pidfile;
 
@@ -95,8 +127,6 @@ sub run_test {
     # we check that the socket has been opened by looking in netstat?
     sleep (2);
 
-    my $g = Sys::Guestfs->new ();
-
     # Add an NBD drive.
     $g->add_drive ("", readonly => $readonly, format => "raw",
                    protocol => "nbd", server => [$server]);
@@ -109,9 +139,9 @@ sub run_test {
     die "roots should be a 1-sized array" unless @roots == 1;
     die "$roots[0] != /dev/VG/Root" unless $roots[0] eq "/dev/VG/Root";
 
-    # Note we have to close the handle (hence killing qemu), and we
-    # have to kill qemu-nbd.
-    $g->close ();
+    # Note we have to shut down the appliance (hence killing qemu),
+    # and we have to kill qemu-nbd.
+    $g->shutdown ();
     kill 15, $pid;
     waitpid ($pid, 0) or die "waitpid: $pid: $!";
     $pid = 0;
@@ -127,6 +157,8 @@ for my $readonly (1, 0) {
 # Test Unix domain socket codepath.
 run_test (0, 0);
 
-unlink $disk;
+$g->close ();
+
+unlink $local_disk if defined $local_disk;
 
 exit 0
@@ -20,6 +20,7 @@
 use strict;
 use warnings;
 
+use Cwd qw(getcwd);
 use Sys::Guestfs;
 use File::Temp qw(tempdir);
 
@@ -72,6 +73,6 @@ delete $ENV{LIBGUESTFS_CACHEDIR};
 delete $ENV{TMPDIR};
 $ENV{TMPDIR} = ".";
 $g = Sys::Guestfs->new ();
-my $pwd = `pwd`; chomp $pwd;
+my $pwd = getcwd ();
 die unless $g->get_tmpdir () eq $pwd;
 die unless $g->get_cachedir () eq $pwd;
@@ -40,16 +40,18 @@ $g->part_disk ("/dev/sda", "mbr");
 
 $g->mkfs ("xfs", "/dev/sda1");
 
-# Setting label.
+# Setting label and UUID.
 $g->set_label ("/dev/sda1", "newlabel");
-my $label = $g->vfs_label ("/dev/sda1");
-die "unexpected label: expecting 'newlabel' but got '$label'"
-    unless $label eq "newlabel";
-
-# Setting UUID.
 my $newuuid = "01234567-0123-0123-0123-0123456789ab";
 $g->set_uuid ("/dev/sda1", $newuuid);
-my $uuid = $g->vfs_uuid ("/dev/sda1");
+
+# Read both back with a single blkid call (one appliance round-trip
+# instead of two).
+my %info = $g->blkid ("/dev/sda1");
+my $label = $info{LABEL} // "";
+die "unexpected label: expecting 'newlabel' but got '$label'"
+    unless $label eq "newlabel";
+my $uuid = $info{UUID} // "";
 die "unexpected UUID: expecting '$newuuid' but got '$uuid'"
     unless $uuid eq $newuuid;
 